@@ -3,10 +3,93 @@ Advanced dependency analysis module for code dependency graphs.
 Provides cycle detection, impact analysis, metrics, and query utilities.
 """
 
-from typing import List, Tuple, Dict, Set, Optional
+from typing import List, Dict, Set, Optional
 from collections import defaultdict, deque
 from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError, Neo4jError
+from loader import Q_SCHEMA
 import json
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # Optional: native graph traversal and strongly-connected-components
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components, shortest_path
+except ImportError:
+    csr_matrix = None
+
+try:
+    # Optional: JIT-compiled Tarjan, used when SciPy is unavailable
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    # Optional: fast JSON encoding for graph export
+    from orjson import dumps as _dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+
+# Name of the in-memory graph projected into the GDS catalog
+GDS_GRAPH_NAME = "deps"
+
+# Error code for calling a procedure that is not installed
+PROCEDURE_NOT_FOUND = "Neo.ClientError.Procedure.ProcedureNotFound"
+
+# Cypher statements are kept as constants and only ever parameterized, so
+# Neo4j sees identical query text on every call and reuses cached plans.
+Q_GDS_DROP = "CALL gds.graph.drop($graph_name, false) YIELD graphName"
+
+Q_GDS_PROJECT = "CALL gds.graph.project($graph_name, 'Variable', 'DEPENDS_ON') YIELD graphName"
+
+Q_GDS_SCC = """
+CALL gds.alpha.scc.stream($graph_name)
+YIELD nodeId, componentId
+WITH componentId, collect(gds.util.asNode(nodeId).name) as members
+WHERE size(members) > 1
+RETURN members
+"""
+
+# One row per source variable with its targets already grouped
+Q_ADJACENCY = """
+MATCH (a:Variable)-[:DEPENDS_ON]->(b:Variable)
+RETURN a.name as src, collect(b.name) as dst
+"""
+
+Q_PATH = """
+MATCH (start:Variable {name: $from_var}), (end:Variable {name: $to_var})
+CALL apoc.algo.allSimplePaths(start, end, 'DEPENDS_ON>', $max_length)
+YIELD path
+RETURN [n in nodes(path) | n.name] as path_list
+ORDER BY length(path)
+LIMIT $limit
+"""
+
+Q_METRICS_DEGREES = """
+MATCH (v:Variable)
+OPTIONAL MATCH (v)<-[i:DEPENDS_ON]-()
+WITH v, count(i) as ind
+OPTIONAL MATCH (v)-[o:DEPENDS_ON]->()
+WITH v, ind, count(o) as outd
+RETURN v.name as name, ind, outd
+"""
+
+Q_UNUSED = """
+MATCH (v:Variable)
+WHERE NOT (v)<-[:DEPENDS_ON]-()
+RETURN v.name as var
+"""
+
+Q_EXPORT_NODES = "MATCH (v:Variable) RETURN v.name as name"
+
+Q_EXPORT_EDGES = "MATCH (a:Variable)-[:DEPENDS_ON]->(b:Variable) RETURN a.name as from, b.name as to"
 
 
 class DependencyAnalyzer:
@@ -15,277 +98,367 @@ class DependencyAnalyzer:
     def __init__(self, driver, db_name: str = "cycleanalysis"):
         self.driver = driver
         self.db_name = db_name
+        self._gds_available: Optional[bool] = None
+        self._gds_projected = False
+        self._apoc_available: Optional[bool] = None
+        # Cached adjacency lists, see _get_adjacency()
+        self._adj: Optional[Dict[str, List[str]]] = None
+        self._radj: Optional[Dict[str, List[str]]] = None
+        # Cached CSR form of the same graph, see _get_csr_arrays()/_get_csr()
+        self._indptr = None
+        self._indices = None
+        self._csr = None
+        self._csr_rev = None
+        self._name_to_idx: Dict[str, int] = {}
+        self._idx_to_name: List[str] = []
+        self._ensure_schema()
+    
+    def _ensure_schema(self):
+        """
+        Make variable lookups by name an index seek rather than a label scan,
+        also when the driver did not come from GraphLoader.connect().
+        Uses the loader's schema statements, which are idempotent.
+        """
+        for statement in Q_SCHEMA:
+            try:
+                self.driver.execute_query(statement, database_=self.db_name)
+            except Neo4jError:
+                # e.g. missing schema privileges; queries still work, just slower
+                pass
     
     def detect_cycles(self) -> List[List[str]]:
         """
-        Detect all circular dependencies in the graph using DFS.
-        Returns list of cycles, where each cycle is a list of variable names.
+        Detect all circular dependencies in the graph.
+        Strongly connected components are computed inside Neo4j with GDS when
+        the plugin is installed, otherwise with Tarjan's algorithm in Python.
+        Returns the groups of mutually dependent variables, each a sorted list
+        of names. A group's members are not in path order; the list of groups
+        is sorted too, so output is the same across runs and backends.
+        """
+        cycles = self._gds_cycles()
+        if cycles is None:
+            cycles = self._tarjan_cycles()
+        
+        # Components have no inherent order, so sorted members identify them
+        groups = {tuple(sorted(cycle)) for cycle in cycles}
+        return [list(group) for group in sorted(groups)]
+    
+    def invalidate_cache(self):
+        """
+        Discard state derived from the current graph contents.
+        Must be called after the graph has been (re)loaded.
+        """
+        if self._gds_projected:
+            try:
+                self.driver.execute_query(
+                    Q_GDS_DROP,
+                    parameters_={"graph_name": GDS_GRAPH_NAME},
+                    database_=self.db_name
+                )
+            except Neo4jError:
+                pass
+            self._gds_projected = False
+        # Re-detect GDS; projecting may have failed only because the graph was empty
+        self._gds_available = None
+        
+        self._adj = None
+        self._radj = None
+        self._indptr = None
+        self._indices = None
+        self._csr = None
+        self._csr_rev = None
+        self._name_to_idx = {}
+        self._idx_to_name = []
+    
+    def _get_adjacency(self) -> Dict[str, List[str]]:
+        """
+        Return the DEPENDS_ON adjacency list (variable -> its dependencies).
+        Fetched from Neo4j once and cached until invalidate_cache() is called.
+        """
+        if self._adj is None:
+            result = self.driver.execute_query(Q_ADJACENCY, database_=self.db_name)
+            
+            adj = {record["src"]: record["dst"] for record in result.records}
+            radj = defaultdict(list)
+            for src, targets in adj.items():
+                for dst in targets:
+                    radj[dst].append(src)
+            self._adj = adj
+            self._radj = dict(radj)
+        return self._adj
+    
+    def _get_reverse_adjacency(self) -> Dict[str, List[str]]:
+        """Return the reversed adjacency list (variable -> its dependents)."""
+        if self._radj is None:
+            self._get_adjacency()
+        return self._radj
+    
+    def _get_csr_arrays(self):
+        """
+        Return the cached adjacency as CSR index arrays (indptr, indices).
+        Row/column indices map to names through _name_to_idx/_idx_to_name.
+        """
+        if self._indptr is None:
+            adj = self._get_adjacency()
+            names = list(dict.fromkeys(
+                name for src, targets in adj.items() for name in (src, *targets)
+            ))
+            name_to_idx = dict(zip(names, range(len(names))))
+            n_edges = sum(len(targets) for targets in adj.values())
+            
+            counts = np.fromiter((len(adj.get(name, ())) for name in names),
+                                 dtype=np.int32, count=len(names))
+            indptr = np.zeros(len(names) + 1, dtype=np.int32)
+            np.cumsum(counts, out=indptr[1:])
+            indices = np.fromiter(
+                (name_to_idx[b] for name in names for b in adj.get(name, ())),
+                dtype=np.int32, count=n_edges
+            )
+            self._indptr = indptr
+            self._indices = indices
+            self._name_to_idx = name_to_idx
+            self._idx_to_name = names
+        return self._indptr, self._indices
+    
+    def _get_csr(self):
+        """Return the cached adjacency as SciPy CSR matrices (forward, reverse)."""
+        if self._csr is None:
+            indptr, indices = self._get_csr_arrays()
+            n = len(indptr) - 1
+            self._csr = csr_matrix(
+                (np.ones(len(indices), dtype=bool), indices, indptr), shape=(n, n)
+            )
+            self._csr_rev = self._csr.transpose().tocsr()
+        return self._csr, self._csr_rev
+    
+    def _depths(self, variable_name: str, reverse: bool) -> Dict[str, int]:
         """
-        query = """
-        MATCH path = (start:Variable)-[:DEPENDS_ON*]->(start:Variable)
-        WHERE length(path) > 0
-        RETURN [n in nodes(path) | n.name] as cycle
-        LIMIT 100
+        Shortest distance from variable_name to every variable reachable over
+        the forward (dependencies) or reverse (dependents) adjacency.
         """
+        if csr_matrix is None:
+            graph = self._get_reverse_adjacency() if reverse else self._get_adjacency()
+            return _bfs_depths(graph, variable_name)
         
-        cycles = []
-        result = self.driver.execute_query(query, database_=self.db_name)
+        csr, csr_rev = self._get_csr()
+        idx = self._name_to_idx.get(variable_name)
+        if idx is None:
+            return {}
         
-        for record in result.records:
-            cycle = record["cycle"]
-            # Remove duplicates while preserving order
-            seen = set()
-            unique_cycle = []
-            for var in cycle:
-                if var not in seen:
-                    unique_cycle.append(var)
-                    seen.add(var)
-                elif var == unique_cycle[0] and len(unique_cycle) > 1:
-                    # Found the cycle, return it
-                    cycles.append(unique_cycle)
-                    break
+        dist = shortest_path(csr_rev if reverse else csr, indices=[idx], unweighted=True)[0]
+        names = self._idx_to_name
+        reached = [(names[i], int(dist[i])) for i in np.flatnonzero(np.isfinite(dist) & (dist > 0))]
+        return dict(sorted(reached, key=lambda item: (item[1], item[0])))
+    
+    def _ensure_gds_projection(self) -> bool:
+        """
+        Project the dependency graph into the GDS catalog once and reuse it.
+        Returns False if the GDS plugin is not available or projecting failed,
+        e.g. because nothing has been loaded yet.
+        """
+        if self._gds_available is False:
+            return False
+        if self._gds_projected:
+            return True
         
-        # Also use Tarjan's algorithm for more comprehensive detection
-        cycles.extend(self._tarjan_cycles())
+        try:
+            # Drop a projection left behind by an earlier session; it may be stale
+            self.driver.execute_query(
+                Q_GDS_DROP,
+                parameters_={"graph_name": GDS_GRAPH_NAME},
+                database_=self.db_name
+            )
+            self.driver.execute_query(
+                Q_GDS_PROJECT,
+                parameters_={"graph_name": GDS_GRAPH_NAME},
+                database_=self.db_name
+            )
+        except ClientError as e:
+            if e.code == PROCEDURE_NOT_FOUND:
+                # GDS plugin is not installed
+                self._gds_available = False
+            return False
         
-        # Remove duplicate cycles
-        unique_cycles = []
-        seen_cycles = set()
-        for cycle in cycles:
-            cycle_tuple = tuple(sorted(cycle))
-            if cycle_tuple not in seen_cycles:
-                seen_cycles.add(cycle_tuple)
-                unique_cycles.append(cycle)
+        self._gds_available = True
+        self._gds_projected = True
+        return True
+    
+    def _gds_cycles(self) -> Optional[List[List[str]]]:
+        """
+        Find strongly connected components with GDS inside the database.
+        Returns None if GDS is not available or the SCC call fails.
+        """
+        if not self._ensure_gds_projection():
+            return None
         
-        return unique_cycles
+        try:
+            result = self.driver.execute_query(
+                Q_GDS_SCC,
+                parameters_={"graph_name": GDS_GRAPH_NAME},
+                database_=self.db_name
+            )
+        except Neo4jError as e:
+            if e.code == PROCEDURE_NOT_FOUND:
+                # This GDS version has no gds.alpha.scc; use Tarjan from now on
+                self._gds_available = False
+            return None
+        return [record["members"] for record in result.records]
     
     def _tarjan_cycles(self) -> List[List[str]]:
-        """Use Tarjan's algorithm to find strongly connected components (cycles)."""
-        # Build adjacency list
-        query = "MATCH (a:Variable)-[:DEPENDS_ON]->(b:Variable) RETURN a.name as from, b.name as to"
-        result = self.driver.execute_query(query, database_=self.db_name)
+        """
+        Use Tarjan's algorithm to find strongly connected components (cycles).
+        Fallback for databases without the GDS plugin; uses SciPy's native
+        implementation when it is installed, or a Numba-compiled one.
+        """
+        graph = self._get_adjacency()
         
-        graph = defaultdict(list)
-        for record in result.records:
-            graph[record["from"]].append(record["to"])
+        if csr_matrix is not None:
+            csr, _ = self._get_csr()
+            _, labels = connected_components(csr, directed=True, connection='strong')
+            return _group_components(labels, self._idx_to_name)
+        if numba is not None:
+            labels, _ = _tarjan_csr(*self._get_csr_arrays())
+            return _group_components(labels, self._idx_to_name)
         
-        # Tarjan's algorithm
+        # Tarjan's algorithm, iterative: an explicit work stack of
+        # (node, successor iterator) replaces recursion so deep dependency
+        # chains cannot hit the interpreter's recursion limit
         index = {}
         lowlink = {}
         stack = []
         on_stack = set()
         cycles = []
-        index_counter = [0]
+        counter = 0
         
-        def strongconnect(v):
-            index[v] = index_counter[0]
-            lowlink[v] = index_counter[0]
-            index_counter[0] += 1
-            stack.append(v)
-            on_stack.add(v)
+        for root in graph:
+            if root in index:
+                continue
             
-            for w in graph.get(v, []):
-                if w not in index:
-                    strongconnect(w)
-                    lowlink[v] = min(lowlink[v], lowlink[w])
-                elif w in on_stack:
-                    lowlink[v] = min(lowlink[v], index[w])
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work_stack = [(root, iter(graph.get(root, ())))]
             
-            if lowlink[v] == index[v]:
-                component = []
-                while True:
-                    w = stack.pop()
-                    on_stack.remove(w)
-                    component.append(w)
-                    if w == v:
+            while work_stack:
+                v, successors = work_stack[-1]
+                
+                for w in successors:
+                    if w not in index:
+                        index[w] = lowlink[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack.add(w)
+                        work_stack.append((w, iter(graph.get(w, ()))))
                         break
-                if len(component) > 1:
-                    cycles.append(component)
-        
-        for node in graph:
-            if node not in index:
-                strongconnect(node)
+                    elif w in on_stack:
+                        lowlink[v] = min(lowlink[v], index[w])
+                else:
+                    # All successors of v visited: close its component if v is a root
+                    work_stack.pop()
+                    if work_stack:
+                        parent = work_stack[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[v])
+                    
+                    if lowlink[v] == index[v]:
+                        component = []
+                        while True:
+                            w = stack.pop()
+                            on_stack.remove(w)
+                            component.append(w)
+                            if w == v:
+                                break
+                        if len(component) > 1:
+                            cycles.append(component)
         
         return cycles
     
-    def find_impact(self, variable_name: str) -> Dict[str, any]:
+    def find_impact(self, variable_name: str, limit: Optional[int] = None) -> Dict[str, any]:
         """
         Find all variables that depend on the given variable (impact analysis).
         Useful for understanding what breaks when you change a variable.
+        If `limit` is given, only the nearest `limit` transitively affected
+        variables are returned; total_affected still counts all of them.
         """
-        query = """
-        MATCH (start:Variable {name: $var_name})
-        MATCH path = (dependent:Variable)-[:DEPENDS_ON*]->(start)
-        WHERE dependent <> start
-        RETURN DISTINCT dependent.name as affected_var, 
-               length(path) as depth
-        ORDER BY depth, affected_var
-        """
-        
-        result = self.driver.execute_query(
-            query, 
-            parameters_={"var_name": variable_name},
-            database_=self.db_name
-        )
-        
-        affected = [record["affected_var"] for record in result.records]
-        depths = {record["affected_var"]: record["depth"] for record in result.records}
+        all_depths = self._depths(variable_name, reverse=True)
+        direct, transitive, depths = _split_by_depth(all_depths, limit)
         
         return {
             "variable": variable_name,
-            "directly_affected": [v for v, d in depths.items() if d == 1],
-            "transitively_affected": [v for v, d in depths.items() if d > 1],
-            "total_affected": len(affected),
-            "affected_variables": affected,
+            "directly_affected": direct,
+            "transitively_affected": transitive,
+            "total_affected": len(all_depths),
             "depths": depths
         }
     
-    def find_dependencies(self, variable_name: str) -> Dict[str, any]:
+    def find_dependencies(self, variable_name: str, limit: Optional[int] = None) -> Dict[str, any]:
         """
         Find all variables that the given variable depends on.
         Useful for understanding what a variable needs to work.
+        If `limit` is given, only the nearest `limit` transitive dependencies
+        are returned; total_dependencies still counts all of them.
         """
-        query = """
-        MATCH (start:Variable {name: $var_name})
-        MATCH path = (start)-[:DEPENDS_ON*]->(dependency:Variable)
-        WHERE dependency <> start
-        RETURN DISTINCT dependency.name as dep_var,
-               length(path) as depth
-        ORDER BY depth, dep_var
-        """
-        
-        result = self.driver.execute_query(
-            query,
-            parameters_={"var_name": variable_name},
-            database_=self.db_name
-        )
-        
-        deps = [record["dep_var"] for record in result.records]
-        depths = {record["dep_var"]: record["depth"] for record in result.records}
+        all_depths = self._depths(variable_name, reverse=False)
+        direct, transitive, depths = _split_by_depth(all_depths, limit)
         
         return {
             "variable": variable_name,
-            "direct_dependencies": [v for v, d in depths.items() if d == 1],
-            "transitive_dependencies": [v for v, d in depths.items() if d > 1],
-            "total_dependencies": len(deps),
-            "all_dependencies": deps,
+            "direct_dependencies": direct,
+            "transitive_dependencies": transitive,
+            "total_dependencies": len(all_depths),
             "depths": depths
         }
     
-    def find_path(self, from_var: str, to_var: str) -> List[List[str]]:
+    def find_path(self, from_var: str, to_var: str,
+                  max_length: int = 10, limit: int = 20) -> List[List[str]]:
         """
-        Find all paths from one variable to another.
+        Find up to `limit` dependency paths from one variable to another,
+        shortest first, considering paths of at most `max_length` steps.
         Useful for understanding the dependency chain.
         """
-        query = """
-        MATCH path = (start:Variable {name: $from_var})-[:DEPENDS_ON*]->(end:Variable {name: $to_var})
-        WITH path, [n in nodes(path) | n.name] as path_list
-        RETURN path_list
-        ORDER BY length(path)
-        LIMIT 20
-        """
+        if self._apoc_available is not False:
+            try:
+                result = self.driver.execute_query(
+                    Q_PATH,
+                    parameters_={"from_var": from_var, "to_var": to_var,
+                                 "max_length": max_length, "limit": limit},
+                    database_=self.db_name
+                )
+                self._apoc_available = True
+                return [record["path_list"] for record in result.records]
+            except ClientError as e:
+                if e.code == PROCEDURE_NOT_FOUND:
+                    # APOC is not installed
+                    self._apoc_available = False
+                # Otherwise (timeout, bad parameter...) fall back for this call only
         
-        result = self.driver.execute_query(
-            query,
-            parameters_={"from_var": from_var, "to_var": to_var},
-            database_=self.db_name
+        return _bounded_paths(
+            self._get_adjacency(), self._get_reverse_adjacency(),
+            from_var, to_var, max_length, limit
         )
-        
-        paths = [record["path_list"] for record in result.records]
-        return paths
     
     def get_metrics(self) -> Dict[str, any]:
         """Get comprehensive metrics about the dependency graph."""
-        queries = {
-            "total_variables": "MATCH (v:Variable) RETURN count(v) as count",
-            "total_dependencies": "MATCH ()-[r:DEPENDS_ON]->() RETURN count(r) as count",
-            "most_dependent": """
-                MATCH (v:Variable)<-[:DEPENDS_ON]-(dependent)
-                WITH v, count(dependent) as count
-                RETURN v.name as var, count
-                ORDER BY count DESC
-                LIMIT 10
-            """,
-            "most_dependencies": """
-                MATCH (v:Variable)-[:DEPENDS_ON]->(dep)
-                WITH v, count(dep) as count
-                RETURN v.name as var, count
-                ORDER BY count DESC
-                LIMIT 10
-            """,
-            "isolated_variables": """
-                MATCH (v:Variable)
-                WHERE NOT (v)-[:DEPENDS_ON]-()
-                RETURN v.name as var
-            """,
-            "root_variables": """
-                MATCH (v:Variable)
-                WHERE NOT (v)<-[:DEPENDS_ON]-()
-                RETURN v.name as var
-            """,
-            "leaf_variables": """
-                MATCH (v:Variable)
-                WHERE NOT (v)-[:DEPENDS_ON]->()
-                RETURN v.name as var
-            """
-        }
+        # A single pass yields the in- and out-degree of every variable; all
+        # other counts and rankings are derived from it locally.
+        with self.driver.session(database=self.db_name) as session:
+            degrees = session.execute_read(
+                lambda tx: [(r["name"], r["ind"], r["outd"]) for r in tx.run(Q_METRICS_DEGREES)]
+            )
         
-        metrics = {}
+        by_in_degree = sorted((d for d in degrees if d[1] > 0), key=lambda d: -d[1])
+        by_out_degree = sorted((d for d in degrees if d[2] > 0), key=lambda d: -d[2])
         
-        for key, query in queries.items():
-            try:
-                result = self.driver.execute_query(query, database_=self.db_name)
-                
-                # Neo4j driver returns result object with .records attribute
-                records = result.records if hasattr(result, 'records') else result
-                
-                if key in ["total_variables", "total_dependencies"]:
-                    metrics[key] = records[0]["count"] if records else 0
-                elif key in ["most_dependent", "most_dependencies"]:
-                    # These queries return both var and count - ensure we create proper tuples
-                    result_list = []
-                    for record in records:
-                        try:
-                            # Neo4j records support dict-like access
-                            var_name = record["var"]
-                            count_val = record["count"]
-                            
-                            # Ensure we have valid values
-                            if var_name is None:
-                                continue
-                            
-                            # Ensure count is an integer
-                            try:
-                                count_val = int(count_val) if count_val is not None else 0
-                            except (ValueError, TypeError):
-                                count_val = 0
-                            
-                            # Create tuple - MUST be exactly 2 elements for unpacking
-                            # Convert to string and int to ensure proper types
-                            tuple_item = (str(var_name), int(count_val))
-                            
-                            # Verify it's a proper 2-tuple before adding
-                            if isinstance(tuple_item, tuple) and len(tuple_item) == 2:
-                                result_list.append(tuple_item)
-                            else:
-                                # Skip if not a proper 2-tuple
-                                continue
-                        except (KeyError, IndexError, TypeError, AttributeError):
-                            # Skip malformed records
-                            continue
-                    metrics[key] = result_list
-                else:
-                    metrics[key] = [record["var"] for record in records]
-            except Exception as e:
-                # If there's an error, set empty/default values
-                if key in ["total_variables", "total_dependencies"]:
-                    metrics[key] = 0
-                elif key in ["most_dependent", "most_dependencies"]:
-                    metrics[key] = []
-                else:
-                    metrics[key] = []
-                # Log the error for debugging (optional)
-                # print(f"Warning: Error processing {key}: {e}")
+        metrics = {
+            "total_variables": len(degrees),
+            "total_dependencies": sum(d[2] for d in degrees),
+            # (var, count) tuples, as the CLI unpacks them
+            "most_dependent": [(name, ind) for name, ind, _ in by_in_degree[:10]],
+            "most_dependencies": [(name, outd) for name, _, outd in by_out_degree[:10]],
+            "isolated_variables": [name for name, ind, outd in degrees if ind == 0 and outd == 0],
+            "root_variables": [name for name, ind, _ in degrees if ind == 0],
+            "leaf_variables": [name for name, _, outd in degrees if outd == 0]
+        }
         
         # Calculate additional metrics
         cycles = self.detect_cycles()
@@ -299,67 +472,258 @@ class DependencyAnalyzer:
         Find variables that are defined but never used as dependencies.
         These might be dead code or output variables.
         """
-        query = """
-        MATCH (v:Variable)
-        WHERE NOT (v)<-[:DEPENDS_ON]-()
-        RETURN v.name as var
-        """
-        
-        result = self.driver.execute_query(query, database_=self.db_name)
+        result = self.driver.execute_query(Q_UNUSED, database_=self.db_name)
         return [record["var"] for record in result.records]
     
     def get_critical_path(self) -> List[str]:
         """
         Find the longest dependency chain (critical path).
         Useful for understanding the most complex dependency flow.
+        Edges inside circular dependencies are ignored so the chain is
+        well defined; it is computed by dynamic programming over the
+        topologically sorted graph.
+        """
+        return _longest_path(self._get_adjacency(), self.detect_cycles())
+    
+    def export_graph_json(self, output_file: str = "dependency_graph.json"):
         """
-        query = """
-        MATCH path = (start:Variable)-[:DEPENDS_ON*]->(end:Variable)
-        WHERE NOT (start)<-[:DEPENDS_ON]-() AND NOT (end)-[:DEPENDS_ON]->()
-        WITH path, [n in nodes(path) | n.name] as path_list
-        RETURN path_list
-        ORDER BY length(path) DESC
-        LIMIT 1
+        Export the entire graph to JSON format.
+        Nodes and edges are streamed from Neo4j into a temporary file that
+        replaces output_file only once the export is complete.
         """
+        tmp_file = f"{output_file}.tmp"
+        try:
+            self._write_graph_json(tmp_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        os.replace(tmp_file, output_file)
         
-        result = self.driver.execute_query(query, database_=self.db_name)
-        if result.records:
-            return result.records[0]["path_list"]
+        return output_file
+    
+    def _write_graph_json(self, path: str):
+        """Stream nodes and edges as JSON into path."""
+        with self.driver.session(database=self.db_name) as session, \
+                open(path, 'wb') as f:
+            f.write(b'{"nodes":[')
+            result = session.run(Q_EXPORT_NODES)
+            for i, record in enumerate(result):
+                if i:
+                    f.write(b',')
+                name = record["name"]
+                f.write(_dumps({"id": name, "label": name}))
+            
+            f.write(b'],"edges":[')
+            result = session.run(Q_EXPORT_EDGES)
+            for i, record in enumerate(result):
+                if i:
+                    f.write(b',')
+                f.write(_dumps({"source": record["from"], "target": record["to"]}))
+            f.write(b']}')
+
+
+def _split_by_depth(depths: Dict[str, int], limit: Optional[int]):
+    """
+    Split depth-ordered variables into direct (depth 1) and transitive ones,
+    keeping at most `limit` transitive entries.
+    Returns (direct, transitive, depths of the returned variables).
+    """
+    direct = []
+    transitive = []
+    shown = {}
+    for var, depth in depths.items():
+        if depth == 1:
+            direct.append(var)
+        elif limit is not None and len(transitive) >= limit:
+            break
+        else:
+            transitive.append(var)
+        shown[var] = depth
+    return direct, transitive, shown
+
+
+def _bfs_depths(graph: Dict[str, List[str]], start: str) -> Dict[str, int]:
+    """
+    Breadth-first search from start over an adjacency list.
+    Returns the shortest distance to every reachable variable other than
+    start, ordered by depth and then name.
+    """
+    depths = {start: 0}
+    queue = deque([start])
+    while queue:
+        v = queue.popleft()
+        depth = depths[v] + 1
+        for w in graph.get(v, ()):
+            if w not in depths:
+                depths[w] = depth
+                queue.append(w)
+    
+    del depths[start]
+    return dict(sorted(depths.items(), key=lambda item: (item[1], item[0])))
+
+
+def _bounded_paths(graph: Dict[str, List[str]], reverse_graph: Dict[str, List[str]],
+                   start: str, end: str, max_length: int, limit: int) -> List[List[str]]:
+    """
+    Enumerate simple paths from start to end in order of length.
+    A backward BFS from end gives every node's distance to the target, so
+    the forward search only extends partial paths that can still reach end
+    within max_length steps, and it stops once `limit` paths are found.
+    """
+    remaining = _bfs_depths(reverse_graph, end)
+    remaining[end] = 0
+    if start not in remaining and start != end:
         return []
     
-    def export_graph_json(self, output_file: str = "dependency_graph.json"):
-        """Export the entire graph to JSON format."""
-        query = """
-        MATCH (a:Variable)-[r:DEPENDS_ON]->(b:Variable)
-        RETURN a.name as from, b.name as to
+    paths = []
+    queue = deque([(start,)])
+    while queue and len(paths) < limit:
+        path = queue.popleft()
+        budget = max_length - len(path)
+        for w in graph.get(path[-1], ()):
+            if w == end:
+                paths.append(list(path) + [w])
+                if len(paths) == limit:
+                    break
+            elif w not in path and remaining.get(w, max_length) <= budget:
+                queue.append(path + (w,))
+    
+    return paths
+
+
+def _longest_path(graph: Dict[str, List[str]], cycles: List[List[str]]) -> List[str]:
+    """
+    Longest path in the graph once edges within each strongly connected
+    component (and self-loops) are dropped, which leaves a DAG.
+    """
+    component = {}
+    for i, cycle in enumerate(cycles):
+        for name in cycle:
+            component[name] = i
+    
+    dag = {}
+    in_degree = defaultdict(int)
+    for v, targets in graph.items():
+        kept = [
+            w for w in targets
+            if w != v and (v not in component or component[v] != component.get(w))
+        ]
+        dag[v] = kept
+        for w in kept:
+            in_degree[w] += 1
+    
+    # Kahn's algorithm
+    order = []
+    queue = deque(v for v in dag if in_degree[v] == 0)
+    while queue:
+        v = queue.popleft()
+        order.append(v)
+        for w in dag[v]:
+            in_degree[w] -= 1
+            if in_degree[w] == 0 and w in dag:
+                queue.append(w)
+    
+    # Longest chain starting at each node, filled in reverse topological order
+    length = {}
+    successor = {}
+    for v in reversed(order):
+        best = 0
+        for w in dag[v]:
+            if length.get(w, 0) + 1 > best:
+                best = length.get(w, 0) + 1
+                successor[v] = w
+        length[v] = best
+    
+    if not length or max(length.values()) == 0:
+        return []
+    
+    v = max(order, key=length.__getitem__)
+    path = [v]
+    while v in successor:
+        v = successor[v]
+        path.append(v)
+    return path
+
+
+def _group_components(labels, idx_to_name: List[str]) -> List[List[str]]:
+    """Group node indices by component label, keeping components with cycles."""
+    order = np.argsort(labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return [
+        [idx_to_name[i] for i in group]
+        for group in np.split(order, boundaries)
+        if len(group) > 1
+    ]
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _tarjan_csr(indptr, indices):
         """
+        Iterative Tarjan over CSR index arrays.
+        Returns (component label per node, size of each component).
+        """
+        n = indptr.shape[0] - 1
+        index = np.full(n, -1, np.int32)
+        lowlink = np.zeros(n, np.int32)
+        on_stack = np.zeros(n, np.bool_)
+        labels = np.full(n, -1, np.int32)
+        stack = np.empty(n, np.int32)
+        work_nodes = np.empty(n, np.int32)
+        work_edges = np.empty(n, np.int32)
+        counter = 0
+        n_components = 0
+        sp = 0
         
-        result = self.driver.execute_query(query, database_=self.db_name)
-        
-        graph_data = {
-            "nodes": [],
-            "edges": []
-        }
-        
-        nodes_set = set()
-        for record in result.records:
-            from_var = record["from"]
-            to_var = record["to"]
+        for root in range(n):
+            if index[root] != -1:
+                continue
             
-            if from_var not in nodes_set:
-                graph_data["nodes"].append({"id": from_var, "label": from_var})
-                nodes_set.add(from_var)
-            if to_var not in nodes_set:
-                graph_data["nodes"].append({"id": to_var, "label": to_var})
-                nodes_set.add(to_var)
+            index[root] = counter
+            lowlink[root] = counter
+            counter += 1
+            stack[sp] = root
+            sp += 1
+            on_stack[root] = True
+            work_nodes[0] = root
+            work_edges[0] = indptr[root]
+            wp = 1
             
-            graph_data["edges"].append({
-                "source": from_var,
-                "target": to_var
-            })
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(graph_data, f, indent=2)
+            while wp > 0:
+                v = work_nodes[wp - 1]
+                e = work_edges[wp - 1]
+                if e < indptr[v + 1]:
+                    w = indices[e]
+                    work_edges[wp - 1] = e + 1
+                    if index[w] == -1:
+                        index[w] = counter
+                        lowlink[w] = counter
+                        counter += 1
+                        stack[sp] = w
+                        sp += 1
+                        on_stack[w] = True
+                        work_nodes[wp] = w
+                        work_edges[wp] = indptr[w]
+                        wp += 1
+                    elif on_stack[w] and index[w] < lowlink[v]:
+                        lowlink[v] = index[w]
+                else:
+                    # All successors of v visited: close its component if v is a root
+                    wp -= 1
+                    if wp > 0:
+                        parent = work_nodes[wp - 1]
+                        if lowlink[v] < lowlink[parent]:
+                            lowlink[parent] = lowlink[v]
+                    
+                    if lowlink[v] == index[v]:
+                        while True:
+                            sp -= 1
+                            w = stack[sp]
+                            on_stack[w] = False
+                            labels[w] = n_components
+                            if w == v:
+                                break
+                        n_components += 1
         
-        return output_file
-
+        return labels, np.bincount(labels, minlength=n_components)
@@ -65,6 +65,7 @@ class DependencyCLI:
         
         try:
             self.loader.clear_database()
+            self.analyzer.invalidate_cache()
             
             if os.path.isfile(path):
                 count = self.loader.load_from_file(path)
@@ -94,8 +95,7 @@ class DependencyCLI:
             else:
                 print(f"Found {len(cycles)} circular dependency group(s):\n")
                 for i, cycle in enumerate(cycles, 1):
-                    cycle_str = " -> ".join(cycle) + " -> " + cycle[0]
-                    print(f"  Cycle {i}: {cycle_str}")
+                    print(f"  Group {i} ({len(cycle)} variables): {', '.join(cycle)}")
                 print("\nNote: Circular dependencies may indicate design issues that require refactoring.")
         
         except Exception as e:
@@ -112,7 +112,7 @@ class DependencyCLI:
             return
         
         try:
-            impact = self.analyzer.find_impact(var_name)
+            impact = self.analyzer.find_impact(var_name, limit=10)
             
             print(f"\nImpact Analysis for '{var_name}':")
             print(f"  Total affected variables: {impact['total_affected']}")
@@ -123,12 +123,14 @@ class DependencyCLI:
                     print(f"    - {var}")
             
             if impact['transitively_affected']:
-                print(f"\n  Transitively affected ({len(impact['transitively_affected'])}):")
-                for var in impact['transitively_affected'][:10]:  # Show first 10
+                # The list is capped for display; the total is derived from total_affected
+                transitive_total = impact['total_affected'] - len(impact['directly_affected'])
+                print(f"\n  Transitively affected ({transitive_total}):")
+                for var in impact['transitively_affected']:
                     depth = impact['depths'][var]
                     print(f"    - {var} (depth: {depth})")
-                if len(impact['transitively_affected']) > 10:
-                    print(f"    ... and {len(impact['transitively_affected']) - 10} more")
+                if transitive_total > len(impact['transitively_affected']):
+                    print(f"    ... and {transitive_total - len(impact['transitively_affected'])} more")
             
             if impact['total_affected'] == 0:
                 print("  This variable is not used by any other variables.")
@@ -147,7 +149,7 @@ class DependencyCLI:
             return
         
         try:
-            deps = self.analyzer.find_dependencies(var_name)
+            deps = self.analyzer.find_dependencies(var_name, limit=10)
             
             print(f"\nDependencies for '{var_name}':")
             print(f"  Total dependencies: {deps['total_dependencies']}")
@@ -158,12 +160,14 @@ class DependencyCLI:
                     print(f"    - {var}")
             
             if deps['transitive_dependencies']:
-                print(f"\n  Transitive dependencies ({len(deps['transitive_dependencies'])}):")
-                for var in deps['transitive_dependencies'][:10]:
+                # The list is capped for display; the total is derived from total_dependencies
+                transitive_total = deps['total_dependencies'] - len(deps['direct_dependencies'])
+                print(f"\n  Transitive dependencies ({transitive_total}):")
+                for var in deps['transitive_dependencies']:
                     depth = deps['depths'][var]
                     print(f"    - {var} (depth: {depth})")
-                if len(deps['transitive_dependencies']) > 10:
-                    print(f"    ... and {len(deps['transitive_dependencies']) - 10} more")
+                if transitive_total > len(deps['transitive_dependencies']):
+                    print(f"    ... and {transitive_total - len(deps['transitive_dependencies'])} more")
             
             if deps['total_dependencies'] == 0:
                 print("  This variable has no dependencies (root variable).")
@@ -204,7 +208,7 @@ class DependencyCLI:
         print("-" * 60)
         
         try:
-            metrics = self5.analyzer.get_metrics()
+            metrics = self.analyzer.get_metrics()
             
             print(f"\nOverall Statistics:")
             print(f"  Total variables: {metrics['total_variables']}")
@@ -319,7 +323,7 @@ class DependencyCLI:
         
         try:
             metrics = self.analyzer.get_metrics()
-            cycles = self.analyzer.detect_cycles()
+            cycles = metrics['cycles']
             
             print("QUICK ANALYSIS RESULTS")
             print("=" * 60)
@@ -332,7 +336,7 @@ class DependencyCLI:
             if cycles:
                 print(f"\nWARNING: {len(cycles)} circular dependency group(s) detected.")
                 for i, cycle in enumerate(cycles[:3], 1):
-                    print(f"  Cycle {i}: {' -> '.join(cycle[:5])}{'...' if len(cycle) > 5 else ''}")
+                    print(f"  Group {i}: {', '.join(cycle[:5])}{', ...' if len(cycle) > 5 else ''}")
             
             if metrics['most_dependent']:
                 try:
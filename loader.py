@@ -3,43 +3,270 @@ Enhanced Neo4j loader with batch operations, better error handling,
 and integration with the analyzer module.
 """
 
-from neo4j import GraphDatabase
-from parser import find_variable_deps
-from typing import List, Tuple, Optional
+from neo4j import GraphDatabase, unit_of_work
+from parser import (
+    Deps, DependencyCache, file_signature, find_variable_deps, find_variable_deps_cached
+)
+from typing import Iterator, List, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import atexit
+import fnmatch
+import functools
 import os
+import re
+import time
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Loader statements; like analyzer.py's, they take parameters only and
+# never vary in text. Q_SCHEMA is the one schema definition; analyzer.py
+# applies it too.
+Q_SCHEMA = [
+    "CREATE CONSTRAINT variable_name_unique IF NOT EXISTS "
+    "FOR (v:Variable) REQUIRE v.name IS UNIQUE",
+    "CREATE INDEX file_path_idx IF NOT EXISTS FOR (f:File) ON (f.path)",
+]
+
+Q_CLEAR = "MATCH (n) DETACH DELETE n"
+
+# Page-cache warm-up. The fallback reads a property so the store is actually
+# touched; a bare count(n) is answered from the count store.
+Q_WARMUP_APOC = "CALL apoc.warmup.run(true, true, true)"
+Q_WARMUP = "MATCH (v:Variable) RETURN count(v.name)"
+
+# File nodes and DEFINED_IN edges are written with the variables;
+# only assigned variables are defined in their file
+Q_INSERT_NODES = """
+UNWIND $files as file
+MERGE (f:File {path: file.path})
+WITH f, file
+UNWIND file.nodes as node
+MERGE (v:Variable {name: node.name})
+WITH f, v, node
+WHERE node.defined
+MERGE (v)-[:DEFINED_IN]->(f)
+"""
+
+# Relies on variable_name_unique for index lookups
+Q_INSERT_EDGES = """
+UNWIND $files as file
+UNWIND file.rows as row
+MATCH (a:Variable {name: row.from_name})
+MATCH (b:Variable {name: row.to_name})
+MERGE (a)-[r:DEPENDS_ON]->(b)
+ON CREATE SET r.line_number = row.line_number,
+              r.filepath = file.path
+"""
+
+Q_APOC_AVAILABLE = """
+SHOW PROCEDURES YIELD name
+WHERE name = 'apoc.periodic.iterate'
+RETURN count(*) > 0 as available
+"""
+
+# Server-side batching for large loads: the same two passes as above, split
+# into transactions by apoc.periodic.iterate. Both passes run serially:
+# parallel relationship MERGEs contend on hub variables and deadlock.
+Q_APOC_INSERT_NODES = """
+CALL apoc.periodic.iterate(
+  'UNWIND $files as file UNWIND file.nodes as node RETURN file.path as path, node',
+  'MERGE (v:Variable {name: node.name})
+   WITH v, node, path
+   WHERE node.defined
+   MERGE (f:File {path: path})
+   MERGE (v)-[:DEFINED_IN]->(f)',
+  {batchSize: $batch_size, parallel: false, params: {files: $files}}
+)
+YIELD failedBatches, errorMessages
+RETURN failedBatches, errorMessages
+"""
+
+Q_APOC_INSERT_EDGES = """
+CALL apoc.periodic.iterate(
+  'UNWIND $files as file UNWIND file.rows as row RETURN file.path as path, row',
+  'MATCH (a:Variable {name: row.from_name})
+   MATCH (b:Variable {name: row.to_name})
+   MERGE (a)-[r:DEPENDS_ON]->(b)
+   ON CREATE SET r.line_number = row.line_number,
+                 r.filepath = path',
+  {batchSize: $batch_size, parallel: false, retries: 3, params: {files: $files}}
+)
+YIELD failedBatches, errorMessages
+RETURN failedBatches, errorMessages
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def _get_driver(uri: str, auth: Tuple[str, str]):
+    """
+    Return the process-wide Neo4j driver for uri/auth, creating it on first use.
+    Drivers are expensive to create and own the connection pool, so every
+    loader/analyzer in the process connecting with the same settings shares
+    one. Drivers are never evicted and are only closed at exit.
+    """
+    driver = GraphDatabase.driver(
+        uri, auth=auth,
+        max_connection_pool_size=50,
+        connection_acquisition_timeout=60
+    )
+    atexit.register(driver.close)
+    return driver
+
+
+def _iter_source_files(root: str, pattern: str = "*.py") -> Iterator[str]:
+    """
+    Recursively yield files under root whose name matches pattern.
+    Uses os.scandir so each entry's type comes from the directory listing
+    without an extra stat() call; hidden and symlinked directories are skipped,
+    as are directories that cannot be read.
+    """
+    match = re.compile(fnmatch.translate(pattern)).match
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    elif entry.is_file() and match(entry.name):
+                        yield entry.path
+        except OSError as e:
+            logger.warning(f"Skipping directory {directory} due to error: {e}")
+
+
+def _file_payload(filepath: str, deps: Deps) -> dict:
+    """
+    Build the write parameters for one file's dependencies.
+    Each distinct variable is listed once; assigned ones are defined in the file.
+    The path is sent once per file rather than on every row.
+    """
+    defined = dict.fromkeys(deps.from_)
+    used = dict.fromkeys(name for name in deps.to if name not in defined)
+    return {
+        "path": filepath,
+        "nodes": (
+            [{"name": name, "defined": True} for name in defined] +
+            [{"name": name, "defined": False} for name in used]
+        ),
+        "rows": [
+            {
+                "from_name": from_name,
+                "to_name": to_name,
+                "line_number": line_number
+            }
+            for from_name, to_name, line_number in zip(deps.from_, deps.to, deps.line)
+        ],
+    }
+
+
+@unit_of_work(timeout=120)
+def _write_batch(tx, files: List[dict]):
+    """
+    Write one batch inside a managed transaction: nodes first, then edges.
+    execute_write retries it on transient errors; the timeout bounds a stuck batch.
+    """
+    tx.run(Q_INSERT_NODES, files=files).consume()
+    tx.run(Q_INSERT_EDGES, files=files).consume()
+
 
 class GraphLoader:
     """Enhanced loader for populating Neo4j with dependency data."""
     
+    # Buffered dependencies are written once either limit is reached
+    FLUSH_ROWS = 5000
+    FLUSH_FILES = 50
+    # Loads of at least this many rows go through APOC when use_apoc is set
+    APOC_MIN_ROWS = 10000
+    # With APOC, the buffer is flushed at this size instead, so every flush
+    # but the last is large enough for APOC and a failed one drops only its files
+    APOC_FLUSH_ROWS = 50000
+    
     def __init__(self, uri: str = "bolt://localhost:7687", 
                  auth: Tuple[str, str] = ("neo4j", "password"),
-                 db_name: str = "cycleanalysis"):
+                 db_name: str = "cycleanalysis",
+                 dep_cache_path: Optional[str] = None,
+                 use_apoc: bool = False,
+                 warm_up: bool = False):
         self.uri = uri
         self.auth = auth
         self.db_name = db_name
         self.driver = None
+        # Opt-in file caching parsed dependencies across runs. It is
+        # unpickled, so it must point somewhere only the user can write.
+        self.dep_cache_path = dep_cache_path
+        self._dep_cache: Optional[DependencyCache] = None
+        # (filepath, dependencies) waiting to be written, see flush()
+        self._pending: List[Tuple[str, Deps]] = []
+        self._pending_rows = 0
+        # Let APOC batch large loads server-side; None = not yet detected
+        self.use_apoc = use_apoc
+        self._apoc_available: Optional[bool] = None
+        # Opt-in page-cache warm-up on connect; it reads the whole graph,
+        # so it only pays off when analyzing an already loaded database
+        self.warm_up_on_connect = warm_up
     
     def connect(self):
         """Establish connection to Neo4j."""
         try:
-            self.driver = GraphDatabase.driver(self.uri, auth=self.auth)
+            self.driver = _get_driver(self.uri, tuple(self.auth))
             self.driver.verify_connectivity()
             logger.info("Neo4j connection successful!")
-            return True
         except Exception as e:
             logger.error(f"Failed to connect to Neo4j: {e}")
+            self.disconnect()
             return False
+        
+        self.ensure_schema()
+        if self.warm_up_on_connect:
+            self.warm_up()
+        return True
+    
+    def ensure_schema(self):
+        """
+        Create the constraint/index that ingestion MERGEs rely on.
+        Without them every MERGE is a label scan; both statements are idempotent.
+        """
+        for statement in Q_SCHEMA:
+            try:
+                self.driver.execute_query(statement, database_=self.db_name)
+            except Exception as e:
+                logger.warning(f"Could not apply schema ({statement}): {e}")
+    
+    def warm_up(self):
+        """
+        Pull the graph into Neo4j's page cache so the first ingest does not
+        pay the cold-start cost. Uses APOC when installed.
+        """
+        start = time.perf_counter()
+        try:
+            self.driver.execute_query(Q_WARMUP_APOC, database_=self.db_name)
+        except Exception as e:
+            # apoc.warmup.run is missing without APOC and removed in Neo4j 5
+            logger.info(f"apoc.warmup.run failed ({e}), scanning Variable names instead")
+            try:
+                self.driver.execute_query(Q_WARMUP, database_=self.db_name)
+            except Exception as e:
+                logger.warning(f"Could not warm up page cache: {e}")
+                return
+        logger.info(f"Warmed up page cache in {time.perf_counter() - start:.2f}s")
     
     def disconnect(self):
-        """Close Neo4j connection."""
+        """
+        Write any buffered dependencies, then release the Neo4j connection.
+        The shared driver stays open for other loaders; it is closed at exit.
+        """
         if self.driver:
-            self.driver.close()
+            try:
+                self.flush()
+            except Exception as e:
+                self._discard_pending(e)
+                self._save_dep_cache()
+            self.driver = None
             logger.info("Disconnected from Neo4j")
     
     def clear_database(self):
@@ -48,18 +275,33 @@ class GraphLoader:
             raise RuntimeError("Not connected to Neo4j. Call connect() first.")
         
         try:
-            self.driver.execute_query(
-                "MATCH (n) DETACH DELETE n",
-                database_=self.db_name
-            )
+            self.driver.execute_query(Q_CLEAR, database_=self.db_name)
             logger.info("Database cleared successfully")
         except Exception as e:
             logger.error(f"Error clearing database: {e}")
             raise
     
-    def load_from_file(self, filepath: str) -> int:
+    def _get_dep_cache(self) -> Optional[DependencyCache]:
+        """Return this loader's dependency cache, loading it on first use, if enabled."""
+        if self._dep_cache is None and self.dep_cache_path is not None:
+            self._dep_cache = DependencyCache(self.dep_cache_path)
+        return self._dep_cache
+    
+    def _save_dep_cache(self):
+        """Write the dependency cache back; failures only cost a reparse next run."""
+        cache = self._dep_cache
+        if cache is None:
+            return
+        try:
+            cache.save()
+        except Exception as e:
+            logger.warning(f"Could not save dependency cache {cache.path}: {e}")
+    
+    def load_from_file(self, filepath: str, flush: bool = True) -> int:
         """
         Load dependencies from a single Python file.
+        With flush=False the write is buffered alongside other files until
+        enough rows are pending or flush() is called.
         Returns the number of relationships loaded.
         """
         if not self.driver:
@@ -67,12 +309,18 @@ class GraphLoader:
         
         logger.info(f"Parsing {filepath} for variable dependencies...")
         
+        cache = self._get_dep_cache()
         try:
-            deps = find_variable_deps(filepath)
+            if cache is not None:
+                deps = find_variable_deps_cached(filepath, cache)
+            else:
+                deps = find_variable_deps(filepath)
             logger.info(f"Found {len(deps)} dependencies in {filepath}")
             
             if deps:
-                self._batch_create_relationships(deps)
+                self._enqueue(deps, filepath)
+            if flush:
+                self.flush()
             
             return len(deps)
         except Exception as e:
@@ -81,85 +329,202 @@ class GraphLoader:
     
     def load_from_directory(self, directory: str, pattern: str = "*.py") -> int:
         """
-        Load dependencies from all Python files in a directory.
-        Returns total number of relationships loaded.
+        Load dependencies from all Python files under a directory, recursively.
+        Files whose rows could not be written are logged and skipped.
+        Returns total number of relationships written.
         """
-        import glob
-        
         if not os.path.isdir(directory):
             raise ValueError(f"Not a valid directory: {directory}")
         
-        python_files = glob.glob(os.path.join(directory, pattern))
-        total_relationships = 0
+        if not self.driver:
+            raise RuntimeError("Not connected to Neo4j. Call connect() first.")
         
-        logger.info(f"Found {len(python_files)} Python files in {directory}")
+        # Rows buffered by earlier load_from_file(flush=False) calls are not
+        # part of this load's count
+        self.flush()
         
-        for filepath in python_files:
+        total_relationships = 0
+        cache = self._get_dep_cache()
+        
+        # Parsing is CPU-bound and independent per file, so it is spread over
+        # worker processes; Neo4j writes stay in this process on one driver.
+        # Files are submitted while the tree is still being scanned.
+        # Unchanged files are served from the dependency cache and never
+        # reach the pool; only this process reads or writes the cache.
+        # Writes are buffered across files and go through one session.
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor, \
+                self.driver.session(database=self.db_name) as session:
+            futures = {}
+            file_count = 0
+            cache_hits = 0
+            for filepath in _iter_source_files(directory, pattern):
+                file_count += 1
+                signature = None
+                if cache is not None:
+                    try:
+                        signature = file_signature(filepath)
+                    except OSError as e:
+                        logger.warning(f"Skipping {filepath} due to error: {e}")
+                        continue
+                    deps = cache.get(filepath, signature)
+                    if deps is not None:
+                        cache_hits += 1
+                        if deps:
+                            total_relationships += self._enqueue_or_skip(deps, filepath, session)
+                        continue
+                futures[executor.submit(find_variable_deps, filepath)] = (filepath, signature)
+            logger.info(f"Found {file_count} Python files in {directory} "
+                        f"({cache_hits} unchanged since last run)")
+            
+            for future in as_completed(futures):
+                filepath, signature = futures[future]
+                try:
+                    deps = future.result()
+                except Exception as e:
+                    logger.warning(f"Skipping {filepath} due to error: {e}")
+                    continue
+                logger.info(f"Found {len(deps)} dependencies in {filepath}")
+                if cache is not None:
+                    cache.put(filepath, signature, deps)
+                if deps:
+                    total_relationships += self._enqueue_or_skip(deps, filepath, session)
+            
             try:
-                count = self.load_from_file(filepath)
-                total_relationships += count
+                total_relationships += self._flush_pending(session)
             except Exception as e:
-                logger.warning(f"Skipping {filepath} due to error: {e}")
-                continue
+                self._discard_pending(e)
         
+        self._save_dep_cache()
         return total_relationships
     
-    def _batch_create_relationships(self, relationships: List[Tuple[str, str, int, str]]):
+    def _enqueue(self, deps: Deps, filepath: str, session=None) -> int:
+        """
+        Buffer one file's dependencies, flushing once enough rows or files are pending.
+        Coalescing small files saves a round-trip per file.
+        Returns the number of relationships written by this call.
+        """
+        self._pending.append((filepath, deps))
+        self._pending_rows += len(deps)
+        if self.use_apoc and self._has_apoc():
+            if self._pending_rows >= self.APOC_FLUSH_ROWS:
+                return self._flush_pending(session)
+            return 0
+        if (self._pending_rows >= self.FLUSH_ROWS or
+                len(self._pending) >= self.FLUSH_FILES):
+            return self._flush_pending(session)
+        return 0
+    
+    def _enqueue_or_skip(self, deps: Deps, filepath: str, session) -> int:
+        """Like _enqueue, but a failed write drops the buffered files instead of raising."""
+        try:
+            return self._enqueue(deps, filepath, session)
+        except Exception as e:
+            self._discard_pending(e)
+            return 0
+    
+    def flush(self) -> int:
+        """
+        Write every buffered file's dependencies to Neo4j and save the
+        dependency cache.
+        If the write fails the buffer is kept, so it can be retried; the
+        writes are MERGEs, so rows committed before the failure are not duplicated.
+        Returns the number of relationships written.
+        """
+        written = self._flush_pending()
+        self._save_dep_cache()
+        return written
+    
+    def _flush_pending(self, session=None) -> int:
+        """Write the buffer through `session`, see flush()."""
+        if not self._pending:
+            return 0
+        self._batch_create_relationships(self._pending, session=session)
+        written = self._pending_rows
+        self._pending, self._pending_rows = [], 0
+        return written
+    
+    def _discard_pending(self, error: Exception):
+        """Drop the buffered files after a failed write, naming every one of them."""
+        filepaths = [filepath for filepath, _ in self._pending]
+        logger.warning(f"Skipping {len(filepaths)} files ({self._pending_rows} relationships) "
+                       f"due to write error, some rows may already be committed: {error}")
+        for filepath in filepaths:
+            logger.warning(f"  not fully loaded: {filepath}")
+        self._pending, self._pending_rows = [], 0
+    
+    def _batch_create_relationships(self, files: List[Tuple[str, Deps]],
+                                    batch_size: int = 1000, session=None):
         """
         Efficiently create relationships in batches.
-        Uses UNWIND for better performance.
+        `files` holds (filepath, dependencies) pairs. Slices of up to batch_size
+        rows, drawn from one or more files, are each written with UNWIND in
+        their own managed transaction, so transaction size stays bounded while
+        small files share a round-trip.
+        Each distinct variable per file is MERGEd once, then the edges MATCH
+        their endpoints instead of MERGEing both ends on every row.
+        Writes through `session` if given, otherwise opens one.
         """
-        # Prepare data for batch insert
-        batch_data = [
-            {
-                "from_name": dep[0],
-                "to_name": dep[1],
-                "line_number": dep[2],
-                "filepath": dep[3]
-            }
-            for dep in relationships
-        ]
+        if session is None:
+            with self.driver.session(database=self.db_name) as session:
+                return self._batch_create_relationships(files, batch_size, session)
         
-        query = """
-        UNWIND $data as row
-        MERGE (a:Variable {name: row.from_name})
-        MERGE (b:Variable {name: row.to_name})
-        MERGE (a)-[r:DEPENDS_ON]->(b)
-        ON CREATE SET r.line_number = row.line_number,
-                      r.filepath = row.filepath
-        """
+        if (self.use_apoc and
+                sum(len(deps) for _, deps in files) >= self.APOC_MIN_ROWS and
+                self._has_apoc()):
+            return self._apoc_create_relationships(files, batch_size, session)
         
+        total = 0
         try:
-            self.driver.execute_query(
-                query,
-                parameters_={"data": batch_data},
-                database_=self.db_name
-            )
-            logger.info(f"Loaded {len(relationships)} relationships into Neo4j")
+            group = []
+            group_rows = 0
+            for filepath, relationships in files:
+                for i in range(0, len(relationships), batch_size):
+                    batch = relationships[i:i + batch_size]
+                    if group and group_rows + len(batch) > batch_size:
+                        session.execute_write(_write_batch, group)
+                        group = []
+                        group_rows = 0
+                    group.append(_file_payload(filepath, batch))
+                    group_rows += len(batch)
+                total += len(relationships)
+            if group:
+                session.execute_write(_write_batch, group)
+            logger.info(f"Loaded {total} relationships from {len(files)} files into Neo4j")
         except Exception as e:
             logger.error(f"Error creating relationships: {e}")
             raise
     
-    def add_file_metadata(self):
-        """Add file information as nodes for better tracking."""
-        if not self.driver:
-            raise RuntimeError("Not connected to Neo4j. Call connect() first.")
-        
-        query = """
-        MATCH (v:Variable)
-        WHERE v.filepath IS NOT NULL
-        WITH DISTINCT v.filepath as filepath
-        MERGE (f:File {path: filepath})
-        WITH f, filepath
-        MATCH (v:Variable {filepath: filepath})
-        MERGE (v)-[:DEFINED_IN]->(f)
+    def _has_apoc(self) -> bool:
+        """Check once whether apoc.periodic.iterate is installed."""
+        if self._apoc_available is None:
+            try:
+                result = self.driver.execute_query(Q_APOC_AVAILABLE, database_=self.db_name)
+                self._apoc_available = bool(result.records and result.records[0]["available"])
+            except Exception as e:
+                logger.warning(f"Could not detect APOC, writing without it: {e}")
+                self._apoc_available = False
+        return self._apoc_available
+    
+    def _apoc_create_relationships(self, files: List[Tuple[str, Deps]],
+                                   batch_size: int, session):
+        """
+        Write a large load with apoc.periodic.iterate, which commits every
+        batch_size rows itself and spreads the edge writes over server threads.
         """
+        payload = [_file_payload(filepath, deps) for filepath, deps in files]
         
         try:
-            self.driver.execute_query(query, database_=self.db_name)
-            logger.info("File metadata added")
+            for query in (Q_APOC_INSERT_NODES, Q_APOC_INSERT_EDGES):
+                record = session.run(query, files=payload, batch_size=batch_size).single()
+                if record["failedBatches"]:
+                    raise RuntimeError(
+                        f"{record['failedBatches']} batches failed: {record['errorMessages']}"
+                    )
+            logger.info(f"Loaded {sum(len(deps) for _, deps in files)} relationships "
+                        f"from {len(files)} files into Neo4j via APOC")
         except Exception as e:
-            logger.error(f"Error adding file metadata: {e}")
+            logger.error(f"Error creating relationships: {e}")
+            raise
 
 
 def main():
@@ -1,6 +1,42 @@
 import ast
 import os
-from typing import List, Tuple, Dict, Set
+import pickle
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Iterator, List, Tuple, Dict, Set, Optional, Union
+
+# Bump whenever the shape or meaning of cached dependency lists changes
+DEP_CACHE_VERSION = 2
+
+# Fields holding nested statements, in ast field order: compound statement
+# bodies, except handlers and match cases. Other fields are expressions.
+_BODY_FIELDS = ('body', 'handlers', 'orelse', 'finalbody', 'cases')
+
+@dataclass
+class Deps:
+    """
+    Dependencies found in one file, stored as parallel columns.
+    Avoids a tuple per dependency; iterating still yields
+    (assigned_var, used_var, line_number, filepath) tuples.
+    """
+    from_: List[str] = field(default_factory=list)
+    to: List[str] = field(default_factory=list)
+    line: List[int] = field(default_factory=list)
+    filepath: str = ""
+
+    def __len__(self) -> int:
+        return len(self.from_)
+
+    def __iter__(self) -> Iterator[Tuple[str, str, int, str]]:
+        filepath = self.filepath
+        for from_name, to_name, line_number in zip(self.from_, self.to, self.line):
+            yield (from_name, to_name, line_number, filepath)
+
+    def __getitem__(self, index):
+        """An int gives one dependency tuple, a slice gives a Deps"""
+        if isinstance(index, slice):
+            return Deps(self.from_[index], self.to[index], self.line[index], self.filepath)
+        return (self.from_[index], self.to[index], self.line[index], self.filepath)
 
 class VariableDependencyFinder(ast.NodeVisitor):
     """
@@ -8,14 +44,41 @@ class VariableDependencyFinder(ast.NodeVisitor):
     Tracks file paths, line numbers, and variable locations.
     """
 
-    def __init__(self, filepath: str = ""):
-        # List of tuples: (assigned_var, used_var, line_number, filepath)
-        self.dependencies: List[Tuple[str, str, int, str]] = []
-        self.current_assign_target = None
+    def __init__(self, filepath: str = "", metadata: bool = True):
+        # Columns of (assigned_var, used_var, line_number), all from filepath
+        self.dependencies = Deps(filepath=filepath)
         self.current_line = 0
         self.filepath = filepath
-        self.variable_locations: Dict[str, List[int]] = {}  # var_name -> [line_numbers]
+        self.variable_locations: Dict[str, List[int]] = defaultdict(list)  # var_name -> [line_numbers]
         self.all_variables: Set[str] = set()
+        # (assigned_var, used_var) pairs already recorded; first occurrence wins
+        self._seen: Set[Tuple[str, str]] = set()
+        # Without metadata only the pairs in _seen are kept, see pairs
+        self.metadata = metadata
+
+    @property
+    def pairs(self) -> Set[Tuple[str, str]]:
+        """Every distinct (assigned_var, used_var) pair found"""
+        return self._seen
+
+    def visit_statements(self, stmts: List[ast.stmt]):
+        """
+        Visit only the assignments in a list of statements, descending into
+        compound statement bodies (def, class, if, for, with, try, match...).
+        Decorators, annotations, conditions, imports and docstrings cannot
+        record dependencies, so their subtrees are never walked.
+        """
+        for stmt in stmts:
+            stmt_type = type(stmt)
+            if stmt_type is ast.Assign:
+                self.visit_Assign(stmt)
+            elif stmt_type is ast.AugAssign:
+                self.visit_AugAssign(stmt)
+            else:
+                for attr in _BODY_FIELDS:
+                    children = getattr(stmt, attr, None)
+                    if children:
+                        self.visit_statements(children)
 
     def visit_Assign(self, node):
         """Called when visiting an assignment like 'a = b' or 'a, b = x, y'"""
@@ -23,13 +86,12 @@ class VariableDependencyFinder(ast.NodeVisitor):
         
         # Handle single-variable assignments: a = b
         if len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
-            self.current_assign_target = node.targets[0].id
-            self.all_variables.add(self.current_assign_target)
-            self._record_location(self.current_assign_target, node.lineno)
+            assigned_var = node.targets[0].id
+            self.all_variables.add(assigned_var)
+            self._record_location(assigned_var, node.lineno)
             
-            # Visit the right-hand side (the "value")
-            self.visit(node.value)
-            self.current_assign_target = None
+            # Every name read in the right-hand side (the "value")
+            self._add_loads(assigned_var, node.value)
             
         # Handle tuple unpacking: a, b = x, y
         elif len(node.targets) == 1 and isinstance(node.targets[0], ast.Tuple):
@@ -40,20 +102,20 @@ class VariableDependencyFinder(ast.NodeVisitor):
                 value_tuple = node.value
                 for target_node, value_node in zip(target_tuple.elts, value_tuple.elts):
                     if isinstance(target_node, ast.Name):
-                        self.current_assign_target = target_node.id
-                        self.all_variables.add(self.current_assign_target)
-                        self._record_location(self.current_assign_target, node.lineno)
-                        self.visit(value_node)
-                        self.current_assign_target = None
+                        self.all_variables.add(target_node.id)
+                        self._record_location(target_node.id, node.lineno)
+                        self._add_loads(target_node.id, value_node)
             else:
-                # If value is not a tuple (e.g., a, b = some_function())
+                # If value is not a tuple (e.g., a, b = some_function()),
+                # walk it once and make every target depend on every name used
+                loads = _collect_loads(node.value)
+                self.all_variables.update(used_var for used_var, _ in loads)
                 for target_node in target_tuple.elts:
                     if isinstance(target_node, ast.Name):
-                        self.current_assign_target = target_node.id
-                        self.all_variables.add(self.current_assign_target)
-                        self._record_location(self.current_assign_target, node.lineno)
-                        self.visit(node.value)
-                        self.current_assign_target = None
+                        self.all_variables.add(target_node.id)
+                        self._record_location(target_node.id, node.lineno)
+                        for used_var, line_number in loads:
+                            self._add_dependency(target_node.id, used_var, line_number)
     
     def visit_AugAssign(self, node):
         """Called when visiting augmented assignments like 'a += b' or 'a *= c'"""
@@ -65,68 +127,149 @@ class VariableDependencyFinder(ast.NodeVisitor):
             self._record_location(assigned_var, node.lineno)
             
             # Record self-dependency for augmented assignments
-            self.dependencies.append((assigned_var, assigned_var, node.lineno, self.filepath))
+            self._add_dependency(assigned_var, assigned_var, node.lineno)
             
             # Then, find all variables used in the right-hand side
-            self.current_assign_target = assigned_var
-            self.visit(node.value)
-            self.current_assign_target = None
-            
-    def visit_Name(self, node):
-        """Called for *every* variable name found in the code"""
-        if self.current_assign_target and isinstance(node.ctx, ast.Load):
-            assigned_var = self.current_assign_target
-            used_var = node.id
+            self._add_loads(assigned_var, node.value)
+    
+    def _add_loads(self, assigned_var: str, value: ast.AST):
+        """Make assigned_var depend on every variable read inside value"""
+        for used_var, line_number in _collect_loads(value):
             self.all_variables.add(used_var)
-            self.dependencies.append((assigned_var, used_var, node.lineno, self.filepath))
+            self._add_dependency(assigned_var, used_var, line_number)
+    
+    def _add_dependency(self, assigned_var: str, used_var: str, line_number: int):
+        """Record a dependency unless the same pair was already recorded"""
+        key = (assigned_var, used_var)
+        if key not in self._seen:
+            self._seen.add(key)
+            if not self.metadata:
+                return
+            deps = self.dependencies
+            deps.from_.append(assigned_var)
+            deps.to.append(used_var)
+            deps.line.append(line_number)
     
     def _record_location(self, var_name: str, line_number: int):
         """Record where a variable is defined/assigned"""
-        if var_name not in self.variable_locations:
-            self.variable_locations[var_name] = []
         self.variable_locations[var_name].append(line_number)
 
-def find_variable_deps(filepath: str) -> List[Tuple[str, str, int, str]]:
+def _collect_loads(value: ast.AST) -> List[Tuple[str, int]]:
+    """
+    Return (name, line_number) for every variable read inside an expression.
+    Walks depth-first in source order, like NodeVisitor, so the first
+    occurrence of a repeated name keeps its line number.
+    """
+    loads = []
+    stack = [value]
+    while stack:
+        node = stack.pop()
+        if type(node) is ast.Name:
+            if type(node.ctx) is ast.Load:
+                loads.append((node.id, node.lineno))
+        else:
+            stack.extend(reversed(list(ast.iter_child_nodes(node))))
+    return loads
+
+def find_variable_deps(filepath: str, metadata: bool = True) -> Union[Deps, Set[Tuple[str, str]]]:
     """
     Parses a Python file and returns dependencies with metadata.
     
     Returns:
-        List of tuples: (assigned_var, used_var, line_number, filepath)
+        Deps; iterating it yields (assigned_var, used_var, line_number, filepath).
+        With metadata=False, just the set of (assigned_var, used_var) pairs.
     """
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"File not found: {filepath}")
     
+    # Read raw bytes: ast.parse decodes them itself, honouring any coding cookie
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
+        with open(filepath, 'rb') as f:
             content = f.read()
-    except Exception as e:
+    except OSError as e:
         raise IOError(f"Error reading {filepath}: {e}")
     
     try:
         tree = ast.parse(content, filename=filepath)
-        finder = VariableDependencyFinder(filepath)
-        finder.visit(tree)
-        # Return unique dependencies (preserving metadata)
-        seen = set()
-        unique_deps = []
-        for dep in finder.dependencies:
-            key = (dep[0], dep[1])  # (assigned_var, used_var)
-            if key not in seen:
-                seen.add(key)
-                unique_deps.append(dep)
-        return unique_deps
+        finder = VariableDependencyFinder(filepath, metadata)
+        finder.visit_statements(tree.body)
+        # Already unique per (assigned_var, used_var), metadata preserved
+        return finder.dependencies if metadata else finder.pairs
     except SyntaxError as e:
         raise SyntaxError(f"Syntax error in {filepath} at line {e.lineno}: {e.msg}")
     except Exception as e:
         raise Exception(f"Error parsing {filepath}: {e}")
 
+def file_signature(filepath: str) -> Tuple[int, int]:
+    """Return (mtime_ns, size) used to tell whether a file changed"""
+    st = os.stat(filepath)
+    return (st.st_mtime_ns, st.st_size)
+
+class DependencyCache:
+    """
+    Persistent cache of parsed dependencies keyed by (filepath, mtime, size).
+    Lets repeated loads of the same tree skip parsing unchanged files.
+    Entries written by a different DEP_CACHE_VERSION are discarded on load.
+    The file is unpickled, so only point this at a path you trust.
+    """
+
+    def __init__(self, path: str = "_dep_cache.pkl"):
+        self.path = path
+        # filepath -> (signature, dependencies)
+        self.entries: Dict[str, Tuple[Tuple[int, int], Deps]] = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        """Read the cache file; a missing, corrupt or outdated file means an empty cache"""
+        try:
+            with open(self.path, 'rb') as f:
+                version, entries = pickle.load(f)
+        except Exception:
+            return
+        if version == DEP_CACHE_VERSION:
+            self.entries = entries
+
+    def get(self, filepath: str, signature: Tuple[int, int]) -> Optional[Deps]:
+        """Return cached dependencies if the file is unchanged, else None"""
+        entry = self.entries.get(filepath)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        return None
+
+    def put(self, filepath: str, signature: Tuple[int, int], deps: Deps):
+        """Store dependencies parsed from the file as it was at `signature`"""
+        self.entries[filepath] = (signature, deps)
+        self._dirty = True
+
+    def save(self):
+        """Write the cache back if it changed; the file is replaced atomically"""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((DEP_CACHE_VERSION, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+def find_variable_deps_cached(filepath: str, cache: DependencyCache) -> Deps:
+    """
+    Same as find_variable_deps, but reuses the cached result for unchanged files.
+    The caller is responsible for calling cache.save().
+    """
+    signature = file_signature(filepath)
+    deps = cache.get(filepath, signature)
+    if deps is None:
+        deps = find_variable_deps(filepath)
+        cache.put(filepath, signature, deps)
+    return deps
+
 def find_variable_deps_simple(filepath: str) -> List[Tuple[str, str]]:
     """
     Simplified version that returns just (assigned_var, used_var) pairs.
     For backward compatibility.
     """
-    deps = find_variable_deps(filepath)
-    return [(dep[0], dep[1]) for dep in deps]
+    return list(find_variable_deps(filepath, metadata=False))
 
 # --- Main block for testing just this script ---
 if __name__ == "__main__":